@@ -9,12 +9,109 @@ bl_info = {
 }
 
 import bpy
+import concurrent.futures
 import socket
 import os
+import select
 import struct
-import threading
+import tempfile
 import time
 
+try:
+    import netifaces
+except ImportError:
+    netifaces = None
+
+# Worker threads for network transfers, created in register()
+transfer_executor = None
+
+# Temp file of each transfer that has not finished yet, so unregister() can clean up
+pending_transfers = {}
+
+# Discovery broadcast targets, collected in register()
+broadcast_addresses = ('<broadcast>',)
+
+def get_broadcast_addresses():
+    # Always use the limited broadcast, plus each interface's directed broadcast if netifaces is available
+    addresses = ['<broadcast>']
+    if netifaces is None:
+        return tuple(addresses)
+    for interface in netifaces.interfaces():
+        try:
+            for address in netifaces.ifaddresses(interface).get(netifaces.AF_INET, []):
+                broadcast = address.get('broadcast')
+                if broadcast and broadcast not in addresses:
+                    addresses.append(broadcast)
+        except ValueError:
+            continue
+    return tuple(addresses)
+
+def recv_exact(sock, size):
+    # Read exactly size bytes into a preallocated buffer
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError("Connection closed before acknowledgment was received")
+        received += count
+    return bytes(buf)
+
+def recv_acknowledgment(sock):
+    # Newer headsets send a 4-byte big-endian length followed by the message, older ones the bare
+    # text message. A length prefix always starts with a zero byte and text never does, so anything
+    # else is returned from a single recv, as before
+    response = sock.recv(1024)
+    if response[:1] != b'\x00':
+        return response
+    if len(response) < 4:
+        response += recv_exact(sock, 4 - len(response))
+    response_length = struct.unpack('>I', response[:4])[0]
+    if response_length > 65536:
+        raise ValueError(f"Acknowledgment too long ({response_length} bytes)")
+    message = response[4:4 + response_length]
+    return message + recv_exact(sock, response_length - len(message))
+
+def send_data(file_path, file_length, file_name, headset_ip, port):
+    # Prepare data for sending
+    name_bytes = file_name.encode('utf-8')
+    name_length = len(name_bytes)
+
+    # Build the header in one pack call; the file data is streamed separately
+    header = struct.pack(f'>I{name_length}sQ', name_length, name_bytes, file_length)
+
+    # Send the file over TCP
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            # Disable Nagle so the last partial segment isn't held back waiting for an ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(30)  # Set a timeout of 30 seconds
+            print(f"Connecting to {headset_ip}:{port}")
+            sock.connect((headset_ip, port))
+            print("Connection established. Sending data...")
+            # Hold the header back so it leaves in the same segment as the start of the file (Linux)
+            sock.sendall(header, getattr(socket, "MSG_MORE", 0))
+            # Stream the file straight from disk (os.sendfile where supported)
+            with open(file_path, 'rb') as f:
+                sock.sendfile(f)
+            print("Data sent. Waiting for acknowledgment...")
+            response = recv_acknowledgment(sock)
+        if response.decode('utf-8', errors='replace') == 'Success':
+            print("Model transferred successfully.")
+        else:
+            print("Failed to transfer model.")
+    except socket.timeout:
+        print("Connection timed out.")
+    except Exception as e:
+        print(f"Failed to transfer model: {e}")
+    finally:
+        # Remove the temporary file
+        try:
+            os.remove(file_path)
+        except OSError as e:
+            print(f"Error removing temporary file: {e}")
+
 class TransferToHeadsetOperator(bpy.types.Operator):
     """Transfer selected objects to headset"""
     bl_idname = "object.transfer_to_headset"
@@ -30,7 +127,12 @@ class TransferToHeadsetOperator(bpy.types.Operator):
         discovery_port = 5001
 
         # Discover the headset IP address using the code
-        headset_ip = self.discover_headset(discovery_port, code)
+        try:
+            headset_ip = self.discover_headset(discovery_port, code)
+        except OSError as e:
+            print(f"Could not listen for discovery replies: {e}")
+            self.report({'ERROR'}, "Could not listen for headset replies; discovery may already be running.")
+            return {'CANCELLED'}
         if not headset_ip:
             self.report({'ERROR'}, "Could not discover headset on the network.")
             return {'CANCELLED'}
@@ -49,75 +151,90 @@ class TransferToHeadsetOperator(bpy.types.Operator):
 
         export_name = active_object.name
 
-        # Clean the export name to ensure it's a valid filename
-        safe_name = bpy.path.clean_name(export_name)
+        # Clean the export name to ensure it's a valid filename; plain ASCII names are already safe
+        if export_name.isascii() and export_name.replace('_', '').replace('-', '').isalnum():
+            safe_name = export_name
+        else:
+            safe_name = bpy.path.clean_name(export_name)
         file_name = f"{safe_name}.glb"
 
         # Duplicate selected objects with modifiers applied
         duplicates = []
         depsgraph = context.evaluated_depsgraph_get()
         for obj in selected_objects:
-            # Evaluate the object with modifiers applied
-            obj_eval = obj.evaluated_get(depsgraph)
-            mesh = obj_eval.to_mesh()
-            if mesh is None:
+            if obj.type not in {'MESH', 'CURVE', 'SURFACE', 'FONT', 'META'}:
                 print(f"Warning: Could not create mesh for {obj.name}")
                 continue
+            # Evaluate the object with modifiers applied
+            obj_eval = obj.evaluated_get(depsgraph)
             # Create a new mesh object
             new_mesh = bpy.data.meshes.new_from_object(obj_eval)
             new_obj = bpy.data.objects.new(obj.name + "_export", new_mesh)
             new_obj.matrix_world = obj.matrix_world.copy()
-            # Link to the scene collection
-            context.collection.objects.link(new_obj)
             duplicates.append(new_obj)
-            # Free the temporary mesh
-            obj_eval.to_mesh_clear()
 
         if not duplicates:
             self.report({'ERROR'}, "No duplicates created for export.")
             return {'CANCELLED'}
 
-        # Export duplicates to a temporary GLB file
-        temp_dir = bpy.app.tempdir
-        temp_file_path = os.path.join(temp_dir, file_name)
-
-        # Select duplicates for export
-        bpy.ops.object.select_all(action='DESELECT')
+        # Gather the duplicates in a collection outside the scene, then link it in one step
+        # so the scene is only updated once rather than once per object
+        export_collection = bpy.data.collections.new("Headset_Export")
         for obj in duplicates:
-            obj.select_set(True)
-        context.view_layer.objects.active = duplicates[0]
+            export_collection.objects.link(obj)
+        context.scene.collection.children.link(export_collection)
 
-        # Ensure the export format is GLB
-        bpy.ops.export_scene.gltf(
-            filepath=temp_file_path,
-            use_selection=True,
-            export_format='GLB'
-        )
-
-        # Delete the duplicates
-        for obj in duplicates:
-            bpy.data.objects.remove(obj, do_unlink=True)
-
-        # Reselect original objects
-        bpy.ops.object.select_all(action='DESELECT')
-        for obj in selected_objects:
-            obj.select_set(True)
-        context.view_layer.objects.active = active_object
+        # Export, then always remove the duplicates and restore the selection
+        try:
+            # Select duplicates for export
+            bpy.ops.object.select_all(action='DESELECT')
+            for obj in duplicates:
+                obj.select_set(True)
+            context.view_layer.objects.active = duplicates[0]
+
+            # Export duplicates to a uniquely named temporary GLB file, so a transfer still
+            # streaming in the background isn't overwritten by the next export
+            fd, temp_file_path = tempfile.mkstemp(suffix=".glb", dir=bpy.app.tempdir)
+            os.close(fd)
+
+            # Ensure the export format is GLB
+            try:
+                result = bpy.ops.export_scene.gltf(
+                    filepath=temp_file_path,
+                    use_selection=True,
+                    export_format='GLB'
+                )
+            except Exception as e:
+                print(f"Error exporting GLB: {e}")
+                result = {'CANCELLED'}
+        finally:
+            # Delete the duplicates
+            for obj in duplicates:
+                bpy.data.objects.remove(obj, do_unlink=True)
+            bpy.data.collections.remove(export_collection)
+
+            # Reselect original objects
+            bpy.ops.object.select_all(action='DESELECT')
+            for obj in selected_objects:
+                obj.select_set(True)
+            context.view_layer.objects.active = active_object
+
+        # Check the exported file; it is streamed from disk and removed by the network thread
+        file_length = os.path.getsize(temp_file_path) if result == {'FINISHED'} else 0
+        if file_length == 0:
+            os.remove(temp_file_path)
+            self.report({'ERROR'}, "Export failed, nothing to transfer.")
+            return {'CANCELLED'}
 
-        # Read the file data
+        # Hand the data to a network worker thread
         try:
-            with open(temp_file_path, 'rb') as f:
-                file_data = f.read()
+            future = transfer_executor.submit(send_data, temp_file_path, file_length, file_name, headset_ip, port)
         except Exception as e:
-            print(f"Error reading temporary file: {e}")
-            self.report({'ERROR'}, f"Error reading temporary file: {e}")
+            os.remove(temp_file_path)
+            self.report({'ERROR'}, f"Could not start transfer: {e}")
             return {'CANCELLED'}
-
-        # Remove the temporary file
-        os.remove(temp_file_path)
-
-        # Start the network thread to send the data
-        threading.Thread(target=self.send_data, args=(file_data, file_name, headset_ip, port)).start()
+        pending_transfers[future] = temp_file_path
+        future.add_done_callback(lambda done: pending_transfers.pop(done, None))
         self.report({'INFO'}, f"Model transfer started to {headset_ip}...")
         return {'FINISHED'}
 
@@ -126,76 +243,64 @@ class TransferToHeadsetOperator(bpy.types.Operator):
         timeout = 5  # seconds
         listen_port = 5002  # Port to listen for responses
 
-        # Create a UDP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(timeout)
-        sock.bind(("", listen_port))  # Bind to all interfaces on the listening port
-
-        # Enable broadcast mode
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-
-        # Send the broadcast message containing the code
+        # Bind the listening socket first so no reply is missed
+        listen_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            sock.sendto(code.encode('utf-8'), ('<broadcast>', discovery_port))
-            print(f"Broadcasting discovery message with code '{code}' on port {discovery_port}...")
-        except Exception as e:
-            print(f"Failed to send broadcast message: {e}")
-            sock.close()
+            listen_sock.bind(("", listen_port))  # Bind to all interfaces on the listening port
+        except OSError:
+            listen_sock.close()
+            raise
+
+        # Use a separate socket in broadcast mode for sending. It is also watched for replies,
+        # in case the headset answers the sender's address rather than the listening port
+        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        send_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+
+        # Send the broadcast message containing the code to every known broadcast address
+        message = code.encode('utf-8')
+        sent = False
+        for address in broadcast_addresses:
+            try:
+                send_sock.sendto(message, (address, discovery_port))
+                sent = True
+            except Exception as e:
+                print(f"Failed to send broadcast message to {address}: {e}")
+        if not sent:
+            send_sock.close()
+            listen_sock.close()
             return None
+        print(f"Broadcasting discovery message with code '{code}' on port {discovery_port}...")
 
-        # Listen for responses
-        start_time = time.time()
-        while True:
+        # Listen for responses on both sockets until the overall deadline, however many packets arrive
+        headset_ip = None
+        deadline = time.monotonic() + timeout
+        while headset_ip is None:
             try:
-                elapsed_time = time.time() - start_time
-                if elapsed_time > timeout:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
                     print("Discovery timeout reached.")
                     break
-                data, addr = sock.recvfrom(1024)
-                response = data.decode('utf-8')
-                if response == "Headset-Discovery-Response":
-                    print(f"Discovered headset at {addr[0]}")
-                    sock.close()
-                    return addr[0]
-            except socket.timeout:
-                print("Socket timed out waiting for response.")
-                break
+                ready, _, _ = select.select([listen_sock, send_sock], [], [], remaining)
+                if not ready:
+                    print("Discovery timeout reached.")
+                    break
+                for sock in ready:
+                    data, addr = sock.recvfrom(1024)
+                    response = data.decode('utf-8', errors='replace')
+                    if response == "Headset-Discovery-Response":
+                        print(f"Discovered headset at {addr[0]}")
+                        headset_ip = addr[0]
+                        break
+            except ConnectionResetError:
+                # Windows reports ICMP errors for the sending socket this way; keep waiting
+                continue
             except Exception as e:
                 print(f"Error during discovery: {e}")
                 break
 
-        sock.close()
-        return None
-
-    def send_data(self, file_data, file_name, headset_ip, port):
-        # Prepare data for sending
-        name_bytes = file_name.encode('utf-8')
-        name_length = len(name_bytes)
-        file_length = len(file_data)
-
-        # Create the data packet
-        packet = struct.pack('>I', name_length) + name_bytes + struct.pack('>Q', file_length) + file_data
-
-        # Send the file over TCP
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(30)  # Set a timeout of 30 seconds
-            print(f"Connecting to {headset_ip}:{port}")
-            sock.connect((headset_ip, port))
-            print("Connection established. Sending data...")
-            sock.sendall(packet)
-            print("Data sent. Waiting for acknowledgment...")
-            # Wait for acknowledgment
-            response = sock.recv(1024)
-            sock.close()
-            if response.decode('utf-8') == 'Success':
-                print("Model transferred successfully.")
-            else:
-                print("Failed to transfer model.")
-        except socket.timeout:
-            print("Connection timed out.")
-        except Exception as e:
-            print(f"Failed to transfer model: {e}")
+        send_sock.close()
+        listen_sock.close()
+        return headset_ip
 
 class TransferToHeadsetPanel(bpy.types.Panel):
     """Creates a Panel in the 3D Viewport Sidebar"""
@@ -245,6 +350,9 @@ def menu_func(self, context):
     self.layout.operator(TransferToHeadsetOperator.bl_idname)
 
 def register():
+    global transfer_executor, broadcast_addresses
+    transfer_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    broadcast_addresses = get_broadcast_addresses()
     bpy.utils.register_class(TransferToHeadsetPreferences)
     bpy.utils.register_class(TransferToHeadsetOperator)
     bpy.utils.register_class(TransferToHeadsetPanel)
@@ -255,13 +363,28 @@ def register():
         maxlen=4,
         default=""
     )
+    if bpy.app.version < (2, 91, 0):
+        # Older glTF exporters build the binary buffer with repeated bytes concatenation
+        print("Warning: glTF export of large scenes is very slow before Blender 2.91. "
+              "Consider upgrading Blender for faster transfers.")
 
 def unregister():
+    global transfer_executor
     bpy.utils.unregister_class(TransferToHeadsetPreferences)
     bpy.utils.unregister_class(TransferToHeadsetOperator)
     bpy.utils.unregister_class(TransferToHeadsetPanel)
     bpy.types.VIEW3D_MT_object.remove(menu_func)
     del bpy.types.Scene.headset_connection_code
+    # Cancel queued transfers and delete their temp files; a running transfer removes its own
+    for future, file_path in list(pending_transfers.items()):
+        if future.cancel():
+            pending_transfers.pop(future, None)
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                print(f"Error removing temporary file: {e}")
+    transfer_executor.shutdown(wait=False)
+    transfer_executor = None
 
 if __name__ == "__main__":
     register()